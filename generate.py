@@ -8,13 +8,99 @@ class CrosswordCreator():
     def __init__(self, crossword):
         """
         Create new CSP crossword generate.
+
+        Words are stored once in `self.words`, grouped by length; the domain
+        of a variable of length L is an integer bitmask whose bit k is set if
+        `self.words[L][k]` is still possible.
         """
         self.crossword = crossword
+        self._all_vars = tuple(self.crossword.variables)
+        self._n_vars = len(self._all_vars)
+
+        # Each neighbor is stored with the overlap (i, j) where `var`'s ith
+        # character meets the neighbor's jth character
+        self._neighbors = {
+            var: tuple(
+                (neighbor, *self.crossword.overlaps[var, neighbor])
+                for neighbor in self.crossword.neighbors(var)
+            )
+            for var in self.crossword.variables
+        }
+        self._degree = {
+            var: len(neighbors) for var, neighbors in self._neighbors.items()
+        }
+
+        # Numbering words within their length keeps every mask only as wide
+        # as the number of words a variable of that length can take
+        words_by_length = dict()
+        for word in sorted(self.crossword.words):
+            words_by_length.setdefault(len(word), []).append(word)
+        self.words = {
+            length: tuple(words) for length, words in words_by_length.items()
+        }
+        self.index = {
+            word: k
+            for words in self.words.values()
+            for k, word in enumerate(words)
+        }
+
+        # Words used by the search in progress, as one bitmask per length
+        self.used_masks = dict.fromkeys(self.words, 0)
+
+        # Bitmask of all words of each length
+        self.by_length = {
+            length: (1 << len(words)) - 1
+            for length, words in self.words.items()
+        }
+
+        # For each variable length, position and letter, bitmask of the
+        # words of that length with that letter at that position
+        self.letter_at = dict()
+        for var in self.crossword.variables:
+            for position in range(var.length):
+                self.letter_at[var.length, position] = dict()
+        for length, words in self.words.items():
+            if (length, 0) not in self.letter_at:
+                continue
+            for k, word in enumerate(words):
+                for position, letter in enumerate(word):
+                    masks = self.letter_at[length, position]
+                    masks[letter] = masks.get(letter, 0) | 1 << k
+
+        # For each arc (x, y), pair up the masks of the letters that can
+        # appear at the overlap in both variables: (words of `y`, words of `x`)
+        self.supports = dict()
+        for (x, y), overlap in self.crossword.overlaps.items():
+            if overlap:
+                i, j = overlap
+                masks_x = self.letter_at[x.length, i]
+                self.supports[x, y] = tuple(
+                    (mask_y, masks_x[letter])
+                    for letter, mask_y in self.letter_at[y.length, j].items()
+                    if letter in masks_x
+                )
+
+        # Domains start from the words of the right length, so they are
+        # node-consistent from the outset
         self.domains = {
-            var: self.crossword.words.copy()
+            var: self.by_length.get(var.length, 0)
             for var in self.crossword.variables
         }
 
+    def domain_words(self, var, exclude=0):
+        """
+        Return list of the words remaining in the domain of `var`, leaving
+        out those whose bits are set in `exclude`.
+        """
+        words = []
+        candidates = self.words.get(var.length, ())
+        domain = self.domains[var] & ~exclude
+        while domain:
+            low = domain & -domain
+            words.append(candidates[low.bit_length() - 1])
+            domain ^= low
+        return words
+
     def letter_grid(self, assignment):
         """
         Return 2D array representing a given assignment.
@@ -24,22 +110,29 @@ class CrosswordCreator():
             for _ in range(self.crossword.height)
         ]
         for variable, word in assignment.items():
-            direction = variable.direction
-            for k in range(len(word)):
-                i = variable.i + (k if direction == Variable.DOWN else 0)
-                j = variable.j + (k if direction == Variable.ACROSS else 0)
-                letters[i][j] = word[k]
+            for (i, j), letter in zip(variable.cells, word):
+                letters[i][j] = letter
+        return letters
+
+    def letter_grid_sparse(self, assignment):
+        """
+        Return dict mapping each filled cell (i, j) to its letter for a
+        given assignment.
+        """
+        letters = dict()
+        for variable, word in assignment.items():
+            letters.update(zip(variable.cells, word))
         return letters
 
     def print(self, assignment):
         """
         Print crossword assignment to the terminal.
         """
-        letters = self.letter_grid(assignment)
+        letters = self.letter_grid_sparse(assignment)
         for i in range(self.crossword.height):
             for j in range(self.crossword.width):
                 if self.crossword.structure[i][j]:
-                    print(letters[i][j] or " ", end="")
+                    print(letters.get((i, j), " "), end="")
                 else:
                     print("█", end="")
             print()
@@ -52,7 +145,7 @@ class CrosswordCreator():
         cell_size = 100
         cell_border = 2
         interior_size = cell_size - 2 * cell_border
-        letters = self.letter_grid(assignment)
+        letters = self.letter_grid_sparse(assignment)
 
         # Create a blank canvas
         img = Image.new(
@@ -75,21 +168,22 @@ class CrosswordCreator():
                 ]
                 if self.crossword.structure[i][j]:
                     draw.rectangle(rect, fill="white")
-                    if letters[i][j]:
-                        _, _, w, h = draw.textbbox((0, 0), letters[i][j], font=font)
+                    letter = letters.get((i, j))
+                    if letter:
+                        _, _, w, h = draw.textbbox((0, 0), letter, font=font)
                         draw.text(
                             (rect[0][0] + ((interior_size - w) / 2),
                              rect[0][1] + ((interior_size - h) / 2) - 10),
-                            letters[i][j], fill="black", font=font
+                            letter, fill="black", font=font
                         )
 
         img.save(filename)
 
     def solve(self):
         """
-        Enforce node and arc consistency, and then solve the CSP.
+        Enforce arc consistency, and then solve the CSP.
+        (Domains are already node-consistent; see `__init__`.)
         """
-        self.enforce_node_consistency()
         self.ac3()
         return self.backtrack(dict())
 
@@ -98,14 +192,10 @@ class CrosswordCreator():
         Update `self.domains` such that each variable is node-consistent.
         (Remove any values that are inconsistent with a variable's unary
          constraints; in this case, the length of the word.)
+        Domains are built from the words of the right length in `__init__`,
+        so there is nothing left to remove: this is a no-op, kept for API
+        compatibility.
         """
-        for var in self.domains.keys():
-            invalid_words = [word for word in self.domains[var] if len(word) != var.length]
-            for word in invalid_words:
-                self.domains[var].remove(word)
-            
-        
-        
 
     def revise(self, x, y):
         """
@@ -116,18 +206,24 @@ class CrosswordCreator():
         Return True if a revision was made to the domain of `x`; return
         False if no revision was made.
         """
-        revised = False
-        overlap = self.crossword.overlaps[x, y]
-    
-        if overlap:
-            i, j = overlap
-            for word_x in list(self.domains[x]):
-                if not any(i < len(word_x) and j < len(word_y) and word_x[i] == word_y[j] for word_y in self.domains[y]):
-                    self.domains[x].remove(word_x)
-                    revised = True
-                    
-        return revised
+        if (x, y) not in self.supports:
+            return False
+
+        # Words for `x` are supported by any letter still reachable at the
+        # overlap in the domain of `y`
+        domain_x = self.domains[x]
+        domain_y = self.domains[y]
+        support = 0
+        for mask_y, mask_x in self.supports[x, y]:
+            if mask_y & domain_y:
+                support |= mask_x
+
+                # Stop as soon as every word of `x` is supported
+                if domain_x & support == domain_x:
+                    return False
 
+        self.domains[x] = domain_x & support
+        return self.domains[x] != domain_x
 
     def ac3(self, arcs=None):
         """
@@ -138,17 +234,25 @@ class CrosswordCreator():
         Return True if arc consistency is enforced and no domains are empty;
         return False if one or more domains end up empty.
         """
+        # Variables whose domains changed; every arc (z, x) into a dirty `x`
+        # is revised once per pass, however many words `x` lost meanwhile
+        dirty = set()
         if arcs is None:
-            arcs = [(x, y) for x in self.crossword.variables for y in self.crossword.variables if x != y]
+            dirty.update(self._all_vars)
+        else:
+            for x, y in arcs:
+                if self.revise(x, y):
+                    if not self.domains[x]:
+                        return False
+                    dirty.add(x)
 
-        while arcs:
-            x, y = arcs.pop(0)
-            if self.revise(x, y):
-                if not self.domains[x]:
-                    return False
-                for z in self.crossword.neighbors(x):
-                    if z != y:
-                        arcs.append((z, x))
+        while dirty:
+            x = dirty.pop()
+            for z, _, _ in self._neighbors[x]:
+                if self.revise(z, x):
+                    if not self.domains[z]:
+                        return False
+                    dirty.add(z)
         return True
 
     def assignment_complete(self, assignment):
@@ -156,32 +260,41 @@ class CrosswordCreator():
         Return True if `assignment` is complete (i.e., assigns a value to each
         crossword variable); return False otherwise.
         """
-        return set(assignment.keys()) == set(self.crossword.variables)
+        return len(assignment) == self._n_vars
 
     def consistent(self, assignment):
         """
         Return True if `assignment` is consistent (i.e., words fit in crossword
         puzzle without conflicting characters); return False otherwise.
         """
-            # 1. Check for distinct values
-        if len(set(assignment.values())) != len(assignment.values()):
+        # 1. Check for distinct values
+        if len(set(assignment.values())) != len(assignment):
             return False
-        
-        # 2. Check for correct lengths
+
         for var, word in assignment.items():
+
+            # 2. Check for correct lengths
             if var.length != len(word):
                 return False
 
-        # 3. Check for conflicts between neighboring variables
-        for var1, word1 in assignment.items():
-            for var2, word2 in assignment.items():
-                if var1 != var2 and self.crossword.overlaps.get((var1, var2)):  # Using .get() to avoid KeyError
-                    overlap = self.crossword.overlaps[(var1, var2)]
-                    if word1[overlap[0]] != word2[overlap[1]]:
-                        return False
+            # 3. Check for conflicts with neighboring variables
+            for neighbor, i, j in self._neighbors[var]:
+                if neighbor in assignment and word[i] != assignment[neighbor][j]:
+                    return False
 
         return True
 
+    def consistent_with(self, assignment, var, value):
+        """
+        Return True if `value` for `var` agrees with the words of all of its
+        assigned neighbors; return False otherwise.
+        Distinctness is not checked here: `order_domain_values` leaves out
+        the words already marked in `self.used_masks`.
+        """
+        for neighbor, i, j in self._neighbors[var]:
+            if neighbor in assignment and value[i] != assignment[neighbor][j]:
+                return False
+        return True
 
     def order_domain_values(self, var, assignment):
         """
@@ -189,22 +302,33 @@ class CrosswordCreator():
         the number of values they rule out for neighboring variables.
         The first value in the list, for example, should be the one
         that rules out the fewest values among the neighbors of `var`.
+        During a search, words it has already used (see `self.used_masks`)
+        are left out; outside a search no word is.
         """
-            # Function to count the number of ruled-out choices for neighboring unassigned variables
+        # For each unassigned neighbor, count how many of its remaining words
+        # have each letter at the overlapping position
+        histograms = []
+        for neighbor, i, j in self._neighbors[var]:
+            if neighbor not in assignment:
+                domain = self.domains[neighbor]
+                histogram = {
+                    letter: (domain & mask).bit_count()
+                    for letter, mask in self.letter_at[neighbor.length, j].items()
+                }
+                histograms.append((i, domain.bit_count(), histogram))
+
+        # Function to count the number of ruled-out choices for neighboring unassigned variables
         def count_conflicts(value):
-            count = 0
-            for neighbor in self.crossword.neighbors(var):
-                if neighbor not in assignment:
-                    overlap = self.crossword.overlaps[(var, neighbor)]
-                    for neighbor_value in self.domains[neighbor]:
-                        if value[overlap[0]] != neighbor_value[overlap[1]]:
-                            count += 1
-            return count
+            return sum(
+                total - histogram.get(value[i], 0)
+                for i, total, histogram in histograms
+            )
 
         # Sort the domain values based on least-constraining values heuristic
-        domain_values = list(self.domains[var])
-        domain_values.sort(key=lambda value: count_conflicts(value))
-        
+        domain_values = self.domain_words(
+            var, exclude=self.used_masks.get(var.length, 0)
+        )
+        domain_values.sort(key=count_conflicts)
         return domain_values
 
     def select_unassigned_variable(self, assignment):
@@ -215,16 +339,47 @@ class CrosswordCreator():
         degree. If there is a tie, any of the tied variables are acceptable
         return values.
         """
-            # Function to compute the number of remaining values for a variable
-        def num_remaining_values(variable):
-            return len(self.domains[variable])
+        # Scan for the minimum (remaining values, -degree); a variable with
+        # a single remaining value is forced, so take it straight away
+        best = None
+        best_key = None
+        for var in self._all_vars:
+            if var in assignment:
+                continue
+            remaining = self.domains[var].bit_count()
+            if remaining <= 1:
+                return var
+            key = (remaining, -self._degree[var])
+            if best is None or key < best_key:
+                best = var
+                best_key = key
+        return best
+
+    def forward_check(self, assignment, var, value):
+        """
+        Remove from the domain of each unassigned neighbor of `var` the words
+        that do not agree with `value` at their overlap.
+        This is the first step of maintaining arc consistency in `extend`,
+        not a replacement for it: the returned arcs still go to `ac3`.
 
-        # Sort unassigned variables by number of remaining values and then by degree
-        unassigned_vars = [var for var in self.crossword.variables if var not in assignment]
-        unassigned_vars.sort(key=lambda var: (num_remaining_values(var), -len(self.crossword.neighbors(var))))
-        
-        # Return the variable with the minimum remaining values and the maximum degree
-        return unassigned_vars[0]
+        Return the list of arcs whose revision may now remove more words, or
+        None if the domain of some neighbor ends up empty.
+        """
+        arcs = []
+        for neighbor, i, j in self._neighbors[var]:
+            if neighbor in assignment:
+                continue
+            domain = self.domains[neighbor]
+            matching = domain & self.letter_at[neighbor.length, j].get(value[i], 0)
+            if not matching:
+                return None
+            if matching != domain:
+                self.domains[neighbor] = matching
+                arcs.extend(
+                    (z, neighbor) for z, _, _ in self._neighbors[neighbor]
+                    if z not in assignment
+                )
+        return arcs
 
     def backtrack(self, assignment):
         """
@@ -235,28 +390,77 @@ class CrosswordCreator():
 
         If no assignment is possible, return None.
         """
-                # Check if the assignment is complete
+        if not self.consistent(assignment):
+            return None
+        if any(word not in self.index for word in assignment.values()):
+            return None
+
+        # Words already in `assignment` are used, and fix their variables'
+        # domains; narrow the other domains to match before searching
+        self.used_masks = dict.fromkeys(self.words, 0)
+        saved = self.domains.copy()
+        for var, word in assignment.items():
+            bit = 1 << self.index[word]
+            self.used_masks[var.length] |= bit
+            self.domains[var] = bit
+        arcs = [
+            (neighbor, var)
+            for var in assignment
+            for neighbor, _, _ in self._neighbors[var]
+            if neighbor not in assignment
+        ]
+        result = None
+        if self.ac3(arcs):
+            result = self.extend(assignment)
+        if result is None:
+            self.domains = saved
+
+        # The search is over, so no word is in use any more
+        self.used_masks = dict.fromkeys(self.words, 0)
+        return result
+
+    def extend(self, assignment):
+        """
+        Recursively extend `assignment`, whose words are already marked in
+        `self.used_masks` and reflected in `self.domains`, to a complete
+        assignment; return None if that is impossible.
+        """
+        # Check if the assignment is complete
         if self.assignment_complete(assignment):
             return assignment
-        
+
         # Select an unassigned variable using the MRV and degree heuristics
         var = self.select_unassigned_variable(assignment)
-        
+
         # Try assigning values to the selected variable
-        for value in self.order_domain_values(var, assignment):  # <-- Pass 'assignment' here
-          if self.consistent(assignment):
-                assignment[var] = value
-                
+        for value in self.order_domain_values(var, assignment):
+            if not self.consistent_with(assignment, var, value):
+                continue
+            bit = 1 << self.index[value]
+            assignment[var] = value
+            self.used_masks[var.length] |= bit
+
+            # Maintain arc consistency: shrink the domain of `var` to `value`,
+            # then run full AC-3 propagation. Forward checking the unassigned
+            # neighbors is only its first step; it seeds AC-3 with the arcs
+            # into the neighbors that lost words
+            saved = self.domains.copy()
+            self.domains[var] = bit
+            arcs = self.forward_check(assignment, var, value)
+            if arcs is not None and self.ac3(arcs):
+
                 # Recursive call
-                result = self.backtrack(assignment)
-                
+                result = self.extend(assignment)
+
                 # If a valid assignment is found, return it
-                if result:
+                if result is not None:
                     return result
-                
-                # Otherwise, backtrack and try the next value
-                del assignment[var]
-        
+
+            # Otherwise, backtrack and try the next value
+            self.domains = saved
+            del assignment[var]
+            self.used_masks[var.length] ^= bit
+
         # If no value leads to a valid assignment, return None
         return None
 